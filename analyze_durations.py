@@ -84,10 +84,17 @@ def detect_filetype(path):
         return InputFileType.NEWLINES
 
 
-def read_from_file_separated_by_newlines(path):
+def iter_from_file_separated_by_newlines(path):
+    # Streams the file line-by-line so we never hold the whole contents as one string.
     with open(path) as f:
-        contents = f.read()
-    return [float(r) for r in contents.split('\n') if r]  # trailing if is used to remove empty lines.
+        for line in f:
+            measurement = line.strip()
+            if measurement:  # skip empty lines.
+                yield float(measurement)
+
+
+def read_from_file_separated_by_newlines(path):
+    return list(iter_from_file_separated_by_newlines(path))
 
 
 def read_from_perfherder_json(path):
@@ -120,6 +127,9 @@ def read_from_logcat_file(path):
 
 
 def to_stats(measurements_arr):
+    # Accepts any iterable. We materialize rather than computing running stats in one pass
+    # because the median and the replicates output need the full sample list anyway.
+    measurements_arr = list(measurements_arr)
     return {
         'max': max(measurements_arr),
         'mean': stat.mean(measurements_arr),
@@ -3,13 +3,19 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 import argparse
-import urllib.request
+import logging
 import subprocess
+import threading
 import analyze_durations
 import os
-import sys
+import queue
+import shutil
+import tempfile
+import urllib3
 import measure_start_up
-import time
+from collections import namedtuple
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from measure_start_up import PROD_TO_CHANNEL_TO_PKGID, PROD_FENIX, PROD_FOCUS
 from datetime import datetime, timedelta
@@ -19,6 +25,8 @@ DESCRIPTION = """ Allows to get startup performance metrics between two dates.
 This can backfill numbers for either daily nightlys or for two commits.
 """
 
+logger = logging.getLogger(__name__)
+
 BASE_URL_DICT = {}
 BASE_URL_DICT[PROD_FENIX] = ("https://firefox-ci-tc.services.mozilla.com/api/index/v1/task/"
                              "mobile.v2.fenix.nightly.{date}.latest.{architecture}/artifacts/"
@@ -35,24 +43,72 @@ BASE_URL_DICT[PROD_FOCUS + '-v2'] = ("https://firefox-ci-tc.services.mozilla.com
 
 BACKFILL_DIR = "backfill_output"
 
-DURATIONS_OUTPUT_FILE_TEMPLATE = "{run_number}-{apk_name}-{test_name}-durations.txt"
-ANALYZED_DURATIONS_FILE_TEMPLATE = "{run_number}-{apk_name}-{test_name}-analysis.txt"
+# backfill_upload.py relies on this filename shape (the -analysis.txt suffix and the date
+# inside the apk name) so change it carefully.
+OUTPUT_FILE_PREFIX_TEMPLATE = "{run_number}-{apk_name}"
+DURATIONS_OUTPUT_FILE_TEMPLATE = "{prefix}-{test_name}-durations.txt"
+ANALYZED_DURATIONS_FILE_TEMPLATE = "{prefix}-{test_name}-analysis.txt"
 
 BUILD_SRC_TASKCLUSTER = "taskclusterNightly"
 BUILD_SRC_COMMITS = "commitsRange"
 BUILD_SRC_ALL = [BUILD_SRC_TASKCLUSTER, BUILD_SRC_COMMITS]
 
-KEY_NAME = "name"
+DOWNLOADER_URLLIB = "urllib"
+DOWNLOADER_ARIA2C = "aria2c"
+DOWNLOADER_WGET = "wget"
+DOWNLOADER_ALL = [DOWNLOADER_URLLIB, DOWNLOADER_ARIA2C, DOWNLOADER_WGET]
+
+# These keys are used in the stats dicts this module writes; backfill_upload.py reads them.
 KEY_PRODUCT = "product"
-KEY_DATETIME = "date"
-KEY_COMMIT = "commit"
-KEY_ARCHITECTURE = "architecture"
 KEY_TEST_NAME = "test_name"
 
+# Metadata for one apk to analyze. Exactly one of date/commit is set, depending on whether
+# the apk came from a taskcluster nightly or a local commit build.
+ApkMetadata = namedtuple("ApkMetadata", ["name", "date", "commit", "architecture", "product"])
+
+# The invariants of one backfill run, built once in main so the per-apk hot path isn't
+# re-marshaling the same five arguments through every call.
+RunConfig = namedtuple("RunConfig", ["package_id", "measure_script_path", "build_type", "tests", "product"])
+
 DATETIME_FORMAT = "%Y.%m.%d"
 
 MEASURE_START_UP_SCRIPT = "./measure_start_up.py"
 
+DOWNLOAD_MAX_WORKERS = 8
+PROBE_MAX_WORKERS = 16
+
+# Parallel Gradle builds each run a daemon with a multi-GB heap, so the ceiling is memory,
+# not cores.
+BUILD_MAX_WORKERS = 2
+
+# Shared by every gradlew invocation: a daemon is only reused when the JVM args match, so
+# warming with different args would start a second daemon instead of pre-warming the real one.
+GRADLE_JVM_ARGS = "-Dorg.gradle.jvmargs=-Xmx4g"
+
+# How many downloaded-but-not-yet-analyzed apks may queue up before the download producer
+# blocks. Keeps a slow device from letting downloads fill the disk arbitrarily far ahead.
+ANALYSIS_QUEUE_MAX_SIZE = 8
+
+# Sentinel the producer enqueues after the last apk so consumers know to stop.
+_END_OF_QUEUE = object()
+
+# A single pool manager shared by all download threads: reusing its connections to the
+# taskcluster host means we pay the TCP+TLS handshake once instead of once per date.
+_HTTP = urllib3.PoolManager(maxsize=16, retries=urllib3.Retry(3, backoff_factor=0.3))
+
+
+def _run(cmd, **kwargs):
+    # Single wrapper over subprocess.run for every child process we launch: close_fds=False
+    # lets CPython use posix_spawn instead of fork+exec, which adds up over the hundreds of
+    # adb/git/gradle calls a long backfill makes.
+    return subprocess.run(cmd, close_fds=False, **kwargs)
+
+
+def start_adb_server():
+    # Starting the server explicitly up front means no later adb call pays the server
+    # auto-start cost (or races to do so from parallel jobs).
+    _run(["adb", "start-server"], check=False, capture_output=True)
+
 
 def parse_args():
     parser = argparse.ArgumentParser(description=DESCRIPTION)
@@ -85,10 +141,23 @@ def parse_args():
                         help="Path to the repository where the commits will be gotten from")
     parser.add_argument("-c", "--cleanup", action="store_true",
                         help="Remove all apks downloaded since they can takeup lots of space")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="Re-download apks even if they already exist on disk from a previous run")
+    parser.add_argument("--downloader", choices=DOWNLOADER_ALL, default=DOWNLOADER_URLLIB,
+                        help=("the program used to download nightly apks. aria2c and wget open multiple "
+                              "connections per file and can resume interrupted downloads, which helps on "
+                              "high-latency links; both fall back to the built-in downloader when not installed"))
+    parser.add_argument("-j", "--jobs", type=int,
+                        help=("Number of builds to analyze in parallel. Each job is pinned to its own attached "
+                              "device so this is capped at the number of devices `adb devices` reports. "
+                              "Defaults to one job per attached device."))
 
     return parser.parse_args()
 
 
+# Cached because each date's URL is formatted twice (availability probe, then download) and
+# re-runs over the same range repeat the format work.
+@lru_cache(maxsize=None)
 def get_nightly_url(download_date, download_date_str, product, architecture):
     # The url format changed for builds after this date.
     if product == PROD_FOCUS and download_date >= datetime(2021, 11, 5):
@@ -96,131 +165,341 @@ def get_nightly_url(download_date, download_date_str, product, architecture):
     return BASE_URL_DICT[product].format(date=download_date_str, architecture=architecture)
 
 
-def fetch_nightly(download_date, architecture, product):
-    download_date_string = datetime.strftime(download_date, DATETIME_FORMAT)
-    nightly_url = get_nightly_url(download_date, download_date_string, product, architecture)
-    filename = "{}_nightly_{}_{}.apk".format(product, architecture, download_date_string.replace(".", "_"))
-    print("Fetching {}...".format(filename), end="", flush=True)
-    try:
-        urllib.request.urlretrieve(nightly_url, filename=filename)
-    except urllib.error.HTTPError as err:
-        if err.code == 404:
-            print("\n\nThe apk for {date} is not available at this {url}".format(date=download_date, url=nightly_url),
-                  file=sys.stderr)
-        return None
+@lru_cache(maxsize=None)
+def format_download_date(download_date):
+    return datetime.strftime(download_date, DATETIME_FORMAT)
 
-    print(" Success.")
 
-    return {KEY_NAME: filename, KEY_DATETIME: download_date, KEY_COMMIT: "", KEY_ARCHITECTURE: architecture,
-            KEY_PRODUCT: product}
+def get_apk_metadata_for_date(download_date, architecture, product):
+    date_string = format_download_date(download_date)
+    filename = "{}_nightly_{}_{}.apk".format(product, architecture, date_string.replace(".", "_"))
+    return ApkMetadata(name=filename, date=download_date, commit="", architecture=architecture, product=product)
 
 
-def get_date_array_for_range(startdate, enddate):
-    delta_dates = (enddate - startdate).days + 1
-    return [startdate + timedelta(days=i) for i in range(delta_dates)]
+def is_apk_cached(filename):
+    # fetch_nightly only renames a download onto its final name once it completed, so any
+    # existing non-empty file is a fully downloaded apk.
+    return os.path.exists(filename) and os.path.getsize(filename) > 0
 
 
-def download_nightly_for_range(array_of_dates, architecture, product):
-    # TODO if file exist and no -f option
-    apk_metadata_array = [fetch_nightly(date, architecture, product) for date in array_of_dates]
-    return [e for e in apk_metadata_array if e is not None]
+def fetch_nightly(download_date, architecture, product, force=False):
+    apk_metadata = get_apk_metadata_for_date(download_date, architecture, product)
+    filename = apk_metadata.name
+    nightly_url = get_nightly_url(download_date, format_download_date(download_date), product, architecture)
+
+    # The filename is derived from the date & architecture so an existing file already holds
+    # this nightly: reuse it instead of re-paying the download.
+    if not force and is_apk_cached(filename):
+        print("Using cached apk at {} (pass --force to re-download).".format(filename))
+        return apk_metadata
+
+    print("Fetching {}...".format(filename), flush=True)
+    resp = _HTTP.request("GET", nightly_url, preload_content=False)
+    in_progress_filename = filename + ".part"
+    try:
+        if resp.status == 404:
+            logger.error("The apk for %s is not available at this %s", download_date, nightly_url)
+            return None
+        if resp.status != 200:
+            # e.g. a transient 503: anything but success would stream an error body into the
+            # apk file, so fail the date instead.
+            logger.error("Downloading the apk for %s from %s failed with HTTP status %s",
+                         download_date, nightly_url, resp.status)
+            return None
+
+        with open(in_progress_filename, 'wb') as f:
+            shutil.copyfileobj(resp, f)
+    finally:
+        resp.release_conn()
+
+    # Renamed into place only once complete: a run killed mid-download leaves a .part file
+    # that the cache check above never trusts, instead of a partial .apk that it would.
+    os.replace(in_progress_filename, filename)
 
+    print("Fetched {}.".format(filename))
 
-def install_apk(apk_build_path):
-    install_proc = subprocess.run(["adb", "install", apk_build_path], check=False, capture_output=True)
+    return apk_metadata
+
+
+def get_date_array_for_range(startdate, enddate):
+    # Generates lazily: for year-scale ranges there's no need to materialize every datetime
+    # up front, and downstream consumers only iterate.
+    delta_dates = (enddate - startdate).days + 1
+    for i in range(delta_dates):
+        yield startdate + timedelta(days=i)
+
+
+def probe_nightly_urls(array_of_dates, architecture, product):
+    # Not every date has a nightly. Rather than discovering a missing one with a full GET that
+    # 404s inside fetch_nightly, we check all dates up front with cheap concurrent HEAD
+    # requests and only download the ones that exist. Returns the available dates in order.
+    array_of_dates = list(array_of_dates)  # Iterated twice below (probe + zip), so materialize.
+
+    def is_nightly_available(date):
+        url = get_nightly_url(date, format_download_date(date), product, architecture)
+        resp = _HTTP.request("HEAD", url, redirect=True)
+        if resp.status != 200:
+            logger.error("The apk for %s is not available at this %s", date, url)
+            return False
+        return True
+
+    with ThreadPoolExecutor(max_workers=PROBE_MAX_WORKERS) as executor:
+        availability = executor.map(is_nightly_available, array_of_dates)
+        return [date for date, is_available in zip(array_of_dates, availability) if is_available]
+
+
+def download_nightly_with_external_downloader(array_of_dates, architecture, product, force, downloader):
+    apk_metadata_array = [get_apk_metadata_for_date(date, architecture, product) for date in array_of_dates]
+    to_download = [m for m in apk_metadata_array if force or not is_apk_cached(m.name)]
+
+    def url_for(apk_metadata):
+        return get_nightly_url(apk_metadata.date, format_download_date(apk_metadata.date), product, architecture)
+
+    # Like the built-in downloader, the external ones fetch into a .part name that is only
+    # renamed onto the cacheable apk name once the transfer verifiably completed, so a failed
+    # or interrupted run can't leave a partial file that is_apk_cached would trust.
+    if to_download and downloader == DOWNLOADER_ARIA2C:
+        # One aria2c process downloads the whole batch: -j files in parallel, -x/-s connections
+        # per file, plus resume semantics for free.
+        input_lines = []
+        for apk_metadata in to_download:
+            input_lines.append(url_for(apk_metadata))
+            input_lines.append("  out=" + apk_metadata.name + ".part")
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+            f.write("\n".join(input_lines) + "\n")
+            input_file_path = f.name
+        try:
+            _run(["aria2c", "-i", input_file_path, "-j", str(DOWNLOAD_MAX_WORKERS), "-x", "4", "-s", "4",
+                  "--allow-overwrite=true", "--auto-file-renaming=false"], check=False)
+        finally:
+            os.unlink(input_file_path)
+
+        for apk_metadata in to_download:
+            in_progress_filename = apk_metadata.name + ".part"
+            # aria2c keeps a .aria2 control file next to an unfinished download and only
+            # removes it on completion, so its absence marks a fully downloaded file.
+            if os.path.exists(in_progress_filename) and not os.path.exists(in_progress_filename + ".aria2"):
+                os.replace(in_progress_filename, apk_metadata.name)
+    elif to_download:  # wget can't name batch outputs so we run one process per apk, in parallel.
+        def wget_one(apk_metadata):
+            in_progress_filename = apk_metadata.name + ".part"
+            if force:
+                # --continue would resume (or skip) a leftover download: remove it first so
+                # wget always fetches the apk fresh.
+                try:
+                    os.unlink(in_progress_filename)
+                except FileNotFoundError:
+                    pass
+            wget_proc = _run(["wget", "--continue", "-q", "-O", in_progress_filename, url_for(apk_metadata)],
+                             check=False)
+            if wget_proc.returncode == 0:
+                os.replace(in_progress_filename, apk_metadata.name)
+
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_MAX_WORKERS) as executor:
+            for _ in executor.map(wget_one, to_download):
+                pass
+
+    downloaded = []
+    for apk_metadata in apk_metadata_array:
+        if is_apk_cached(apk_metadata.name):
+            downloaded.append(apk_metadata)
+        else:
+            logger.error("%s did not download %s", downloader, apk_metadata.name)
+    return downloaded
+
+
+def iter_nightly_apks(array_of_dates, architecture, product, force=False, downloader=DOWNLOADER_URLLIB):
+    # Yields each apk's metadata as soon as it's available — cached apks first, straight from
+    # disk, then each download as it completes — so the analysis can start on the first apk
+    # while the rest are still downloading.
+    if not force:
+        # Anything on the final apk name is a complete download, so it needs neither the HEAD
+        # probe nor the network at all: a fully cached range re-runs offline, and a cached apk
+        # whose taskcluster artifact has since expired is still analyzed from disk.
+        uncached_dates = []
+        for date in array_of_dates:
+            apk_metadata = get_apk_metadata_for_date(date, architecture, product)
+            if is_apk_cached(apk_metadata.name):
+                print("Using cached apk at {} (pass --force to re-download).".format(apk_metadata.name))
+                yield apk_metadata
+            else:
+                uncached_dates.append(date)
+        if not uncached_dates:
+            return
+        array_of_dates = uncached_dates
+
+    array_of_dates = probe_nightly_urls(array_of_dates, architecture, product)
+
+    if downloader != DOWNLOADER_URLLIB:
+        if shutil.which(downloader):
+            # External downloaders fetch the batch in one go, so streaming starts afterwards.
+            yield from download_nightly_with_external_downloader(
+                array_of_dates, architecture, product, force, downloader)
+            return
+        logger.error("%s is not installed: falling back to the built-in downloader.", downloader)
+
+    # The downloads are network-bound so we run them in parallel; map yields the results in
+    # date order as they complete.
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_MAX_WORKERS) as executor:
+        for apk_metadata in executor.map(lambda date: fetch_nightly(date, architecture, product, force),
+                                         array_of_dates):
+            if apk_metadata is not None:
+                yield apk_metadata
+
+
+def get_adb_args(serial):
+    # `-s` pins the command to one device so parallel jobs don't step on each other.
+    return ["adb"] if serial is None else ["adb", "-s", serial]
+
+
+def list_adb_devices():
+    devices_proc = _run(["adb", "devices"], check=False, capture_output=True, text=True)
+    if devices_proc.returncode != 0:
+        logger.error("Unable to list adb devices. The associated error message was:\n%s", devices_proc.stderr)
+        return []
+
+    # Output format: a "List of devices attached" header, then "<serial>\t<state>" lines.
+    serials = []
+    for line in devices_proc.stdout.splitlines()[1:]:
+        columns = line.split()
+        if len(columns) == 2 and columns[1] == "device":
+            serials.append(columns[0])
+    return serials
+
+
+def install_apk(apk_build_path, serial=None):
+    install_proc = _run(get_adb_args(serial) + ["install", apk_build_path],
+                        check=False, capture_output=True, text=True)
     if install_proc.returncode != 0:
-        print(("\nUnable to install: {apk}. The associated error message was:\n"
-               "{error}".format(apk=apk_build_path, error=install_proc.stderr.decode('utf-8'))),
-              file=sys.stderr)
+        logger.error("Unable to install: %s. The associated error message was:\n%s",
+                     apk_build_path, install_proc.stderr)
         return False
     return True
 
 
-def uninstall_apk(package_id):
-    uninstall_proc = subprocess.run(["adb", "uninstall", package_id], check=False, capture_output=True)
+def uninstall_apk(package_id, serial=None):
+    uninstall_proc = _run(get_adb_args(serial) + ["uninstall", package_id],
+                          check=False, capture_output=True, text=True)
     if uninstall_proc.returncode != 0:
-        print(("\nUnable to uninstall {package_id}. The associated error message was:\n"
-               "{error}".format(package_id=package_id, error=uninstall_proc.stderr.decode('utf-8'))),
-              file=sys.stderr)
-
+        logger.error("Unable to uninstall %s. The associated error message was:\n%s",
+                     package_id, uninstall_proc.stderr)
+
+
+# Prefixes each command's exit status in a batch's output; see run_adb_shell_batch.
+_ADB_BATCH_STATUS_MARKER = "__backfill_status__"
+
+
+def run_adb_shell_batch(shell_commands, serial=None):
+    # Several shell commands joined into one adb invocation: each separate adb launch costs
+    # a fork+exec plus an adb-server round-trip, so batching the per-test device setup
+    # roughly halves that overhead.
+    #
+    # The batch's own exit status is only that of the last command, so each command echoes
+    # a status marker that we parse to report failures individually, the way separate adb
+    # invocations would have.
+    batch_script = '; '.join('{}; echo {}$?'.format(command, _ADB_BATCH_STATUS_MARKER)
+                             for command in shell_commands)
+    batch_proc = _run(get_adb_args(serial) + ['shell', batch_script],
+                      check=False, capture_output=True, text=True)
+    if batch_proc.returncode != 0:
+        logger.error("Unable to run adb shell commands %s. The associated error message was:\n%s",
+                     shell_commands, batch_proc.stderr)
+        return
 
-def clear_app_data(package_id):
-    clear_proc = subprocess.run(['adb', 'shell', 'pm', 'clear', package_id], check=False, capture_output=True)
-    if clear_proc.returncode != 0:
-        print(("\nUnable to clear app data for {package_id}. The associated error message was:\n"
-               "{error}".format(package_id=package_id, error=clear_proc.stderr.decode('utf-8'))),
-              file=sys.stderr)
+    statuses = [line[len(_ADB_BATCH_STATUS_MARKER):].strip()
+                for line in batch_proc.stdout.splitlines()
+                if line.startswith(_ADB_BATCH_STATUS_MARKER)]
+    for command, status in zip(shell_commands, statuses):
+        if status != "0":
+            logger.error("adb shell command '%s' failed with status %s. The associated output was:\n%s",
+                         command, status, batch_proc.stdout + batch_proc.stderr)
 
 
-def maybe_skip_onboarding(package_id, test_name, product):
+def get_skip_onboarding_shell_commands(package_id, test_name, product):
     # We skip onboarding for focus in measure_start_up.py because it's stateful and needs to be called
     # for every cold start intent.
     if product == PROD_FOCUS:
-        return
+        return []
 
     # Onboarding only visibly gets in the way of our MAIN test results.
-    if product == PROD_FOCUS or \
-            test_name not in {measure_start_up.TEST_COLD_MAIN_FF, measure_start_up.TEST_COLD_MAIN_RESTORE}:
-        return
+    if test_name not in {measure_start_up.TEST_COLD_MAIN_FF, measure_start_up.TEST_COLD_MAIN_RESTORE}:
+        return []
 
     # This sets mutable state so we only need to pass this flag once, before we start the actual test.
-    start_proc = subprocess.run(['adb', 'shell', 'am', 'start-activity', '-W',
-                                 '-a', 'android.intent.action.MAIN',
-                                 '--ez', 'performancetest', 'true',  # Skip onboarding.
-                                 '-n' '{}/org.mozilla.fenix.App'.format(package_id)],
-                                check=False, capture_output=True)
-    if start_proc.returncode != 0:
-        print(("\nUnable to skip onboarding. The associated error message was:\n"
-               "{error}".format(error=start_proc.stderr.decode('utf-8'))),
-              file=sys.stderr)
-
-    time.sleep(4)  # ensure skip onboarding call has time to propagate.
-
+    # The sleep ensures the skip onboarding call has time to propagate.
+    return ['am start-activity -W'
+            ' -a android.intent.action.MAIN'
+            ' --ez performancetest true'  # Skip onboarding.
+            ' -n {}/org.mozilla.fenix.App'.format(package_id),
+            'sleep 4']
+
+
+def run_measure_start_up_script(config, durations_output_path, test_name, serial=None):
+    # measure_start_up.py builds its own adb commands so we pin it to a device through
+    # ANDROID_SERIAL, which adb honors like `-s`.
+    env = dict(os.environ)
+    if serial is not None:
+        env["ANDROID_SERIAL"] = serial
+    _run([config.measure_script_path, "--product=" + config.product, config.build_type, test_name,
+          # The iteration count is chosen manually, through trial-and-error,
+          # to minimize both execution time and noise.
+          '--iter-count', '30',
+          durations_output_path], stdout=subprocess.DEVNULL, check=False, env=env)
+
+
+def analyze_nightly_for_one_build(config, index, apk_metadata, serial=None):
+    uninstall_apk(config.package_id, serial)
+
+    print("Installing {}...".format(apk_metadata.name))
+    was_install_successful = install_apk(apk_metadata.name, serial)
+    if was_install_successful:
+        apk_name = apk_metadata.name.split(".")[0]
 
-def run_measure_start_up_script(path_to_measure_start_up_script, durations_output_path, build_type, test_name, product):
-    subprocess.run([path_to_measure_start_up_script, "--product=" + product, build_type, test_name,
-                    # The iteration count is chosen manually, through trial-and-error,
-                    # to minimize both execution time and noise.
-                    '--iter-count', '30',
-                    durations_output_path], stdout=subprocess.PIPE, check=False)
+        # The run number and apk name don't change between tests so format them once.
+        output_file_prefix = os.path.join(BACKFILL_DIR, OUTPUT_FILE_PREFIX_TEMPLATE.format(
+            run_number=index, apk_name=apk_name))
 
+        for test_name in config.tests:
+            print("Running {test_name} on {apk_name}...".format(test_name=test_name, apk_name=apk_name))
 
-def analyze_nightly_for_one_build(index, package_id, path_to_measure_start_up_script, apk_metadata, build_type, tests,
-                                  product):
-    uninstall_apk(package_id)
+            # One batched adb call: clear app data (don't maintain state between tests),
+            # then skip onboarding where the test needs it.
+            shell_commands = ['pm clear {}'.format(config.package_id)]
+            shell_commands += get_skip_onboarding_shell_commands(config.package_id, test_name, config.product)
+            run_adb_shell_batch(shell_commands, serial)
 
-    print("Installing {}...".format(apk_metadata[KEY_NAME]))
-    was_install_successful = install_apk(apk_metadata[KEY_NAME])
-    if was_install_successful:
-        Path(BACKFILL_DIR).mkdir(parents=True, exist_ok=True)
+            # TODO fix verify if file exist to have -f in this script
+            durations_output_path = DURATIONS_OUTPUT_FILE_TEMPLATE.format(
+                prefix=output_file_prefix, test_name=test_name)
+            analyzed_durations_path = ANALYZED_DURATIONS_FILE_TEMPLATE.format(
+                prefix=output_file_prefix, test_name=test_name)
+            run_measure_start_up_script(config, durations_output_path, test_name, serial)
+            get_result_from_durations(durations_output_path, analyzed_durations_path, test_name, config.product)
 
-        apk_name = apk_metadata[KEY_NAME].split(".")[0]
 
-        for test_name in tests:
-            print("Running {test_name} on {apk_name}...".format(test_name=test_name, apk_name=apk_name))
+# Extension -> InputFileType. Every durations file measure_start_up.py writes during one
+# backfill shares a format, so we only pay detect_filetype's open+read for the first file
+# per extension instead of once per apk and test.
+_DURATIONS_FILETYPE_CACHE = {}
 
-            clear_app_data(package_id)  # Don't maintain state between tests.
-            maybe_skip_onboarding(package_id, test_name, product)
 
-            # TODO fix verify if file exist to have -f in this script
-            durations_output_path = os.path.join(BACKFILL_DIR, DURATIONS_OUTPUT_FILE_TEMPLATE.format(
-                run_number=index, apk_name=apk_name, test_name=test_name))
-            analyzed_durations_path = os.path.join(BACKFILL_DIR, ANALYZED_DURATIONS_FILE_TEMPLATE.format(
-                run_number=index, apk_name=apk_name, test_name=test_name))
-            run_measure_start_up_script(path_to_measure_start_up_script, durations_output_path, build_type, test_name,
-                                        product)
-            get_result_from_durations(durations_output_path, analyzed_durations_path, test_name, product)
+def detect_durations_filetype(path):
+    extension = os.path.splitext(path)[1]
+    filetype = _DURATIONS_FILETYPE_CACHE.get(extension)
+    if filetype is None:
+        filetype = analyze_durations.detect_filetype(path)
+        _DURATIONS_FILETYPE_CACHE[extension] = filetype
+    return filetype
 
 
 def get_result_from_durations(start_up_durations_path, analyzed_path, test_name, product):
-    try:
-        filetype = analyze_durations.detect_filetype(start_up_durations_path)
-    except FileNotFoundError:
-        print(("The file {file} doesn't exist, this is probably due to a failure in running"
-               "the measure_start_up.py for the apk with the according date").format(file=start_up_durations_path),
-              file=sys.stderr)
+    if not os.path.exists(start_up_durations_path):
+        logger.error("The file %s doesn't exist, this is probably due to a failure in running"
+                     "the measure_start_up.py for the apk with the according date", start_up_durations_path)
         return
 
+    filetype = detect_durations_filetype(start_up_durations_path)
+
     measurement_arr = filetype.read_from(start_up_durations_path)
     stats = analyze_durations.to_stats(measurement_arr)
     stats[KEY_TEST_NAME] = test_name
@@ -228,63 +507,118 @@ def get_result_from_durations(start_up_durations_path, analyzed_path, test_name,
     analyze_durations.save_output(stats, analyzed_path)
 
 
-def run_performance_analysis_on_nightly(package_id, path_to_measure_start_up_script, array_of_apk_path, build_type,
-                                        tests, product):
-    for idx, apk_path in enumerate(array_of_apk_path):
-        analyze_nightly_for_one_build(idx, package_id, path_to_measure_start_up_script, apk_path, build_type, tests,
-                                      product)
+def make_apk_queue(array_of_apk_metadata):
+    # Wraps an already-built metadata list in the queue shape the analysis consumers expect.
+    apk_queue = queue.Queue()
+    for index, apk_metadata in enumerate(array_of_apk_metadata):
+        apk_queue.put((index, apk_metadata))
+    apk_queue.put(_END_OF_QUEUE)
+    return apk_queue
+
+
+def run_performance_analysis_on_nightly(config, apk_queue, jobs=None):
+    # Created once here rather than per analyzed build: one stat+mkdir instead of N, and no
+    # directory-metadata contention between parallel workers.
+    Path(BACKFILL_DIR).mkdir(parents=True, exist_ok=True)
+
+    serials = list_adb_devices()
+
+    def analyze_from_queue(serial):
+        while True:
+            item = apk_queue.get()
+            if item is _END_OF_QUEUE:
+                apk_queue.put(_END_OF_QUEUE)  # Leave it in place so the other workers stop too.
+                return
+            index, apk_metadata = item
+            analyze_nightly_for_one_build(config, index, apk_metadata, serial)
+
+    # Parallelism is only safe across devices: concurrent installs to a single device make adb
+    # time out. Each worker owns one device; with zero or one device attached we consume the
+    # queue inline with no executor.
+    max_workers = min(jobs, len(serials)) if jobs else len(serials)
+    if max_workers <= 1:
+        analyze_from_queue(serials[0] if serials else None)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(analyze_from_queue, serial) for serial in serials[:max_workers]]
+        for future in futures:
+            future.result()  # Propagate any exception from the worker.
 
 
 def fetch_repository(repository_path, remote_name):
     remote_repo_name = "upstream" if len(remote_name) == 0 else remote_name
 
-    fetch_proc = subprocess.run(["git", "fetch", remote_repo_name], cwd=repository_path, capture_output=True)
+    fetch_proc = _run(["git", "fetch", remote_repo_name], cwd=repository_path, check=False, capture_output=True,
+                      text=True)
 
     if fetch_proc.returncode != 0:
-        print(("\n\nSomething went wrong while fetching this repostirory: {repo} . The associated error message was:"
-               "\n\n {error}".format(repo=repository_path, error=fetch_proc.stderr.decode('utf-8').strip("\n"))),
-              file=sys.stderr)
+        logger.error("Something went wrong while fetching this repostirory: %s . The associated error message was:"
+                     "\n%s", repository_path, fetch_proc.stderr.strip("\n"))
 
 
 def get_all_commits_in_commits_range(start_commit, end_commit, repository_path):
-    commit_proc = subprocess.run(
-        ["git", "rev-list", "--ancestry-path", start_commit + "^.." + end_commit],
-        cwd=repository_path, capture_output=True, text=True)
-
+    # --first-parent keeps the walk on the mainline, one hash per landed change, so we don't
+    # build every commit of merged-in side branches. Streaming stdout line-by-line avoids
+    # materializing the whole rev-list output as one giant string before splitting it.
+    commit_proc = subprocess.Popen(
+        ["git", "rev-list", "--first-parent", "--ancestry-path", start_commit + "^.." + end_commit],
+        cwd=repository_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, close_fds=False)
+
+    for line in commit_proc.stdout:
+        commit_hash = line.strip()
+        if commit_hash:
+            yield commit_hash
+
+    commit_proc.wait()
     if commit_proc.returncode != 0:
-        print(("\n\nSomething went wrong while checking out this commit range: {start}..{end}" +
-               "The associated error message was:\n\n {error}".format(
-                start=start_commit, end=end_commit, error=commit_proc.stderr.decode('utf-8').strip("\n"))),
-              file=sys.stderr)
+        logger.error("Something went wrong while checking out this commit range: %s..%s"
+                     "The associated error message was:\n%s",
+                     start_commit, end_commit, commit_proc.stderr.read().strip("\n"))
 
-    return [e for e in commit_proc.stdout.split("\n") if e]
 
+def warm_gradle_daemon(repository_path):
+    # Starting the daemon once with a trivial task means every assemble in the commit loop
+    # reuses an already-warm JVM instead of paying the ~10-30s Gradle startup per commit.
+    _run(["./gradlew", "--daemon", GRADLE_JVM_ARGS, "help"],
+         cwd=repository_path, check=False, capture_output=True)
 
-def clean_project(repository_path):
-    clean_proc = subprocess.run(["./gradlew", "clean"], cwd=repository_path, capture_output=True)
 
-    if clean_proc.returncode != 0:
-        print(("\n\nSomething went wrong while ./gradlew clean. The associated error message was:"
-               "\n\n {error}".format(error=checkout_proc.stderr.decode('utf-8').strip("\n"))),
-              file=sys.stderr)
-        return
+def stop_gradle_daemon(repository_path):
+    # Don't leave a multi-GB JVM running after the backfill is done.
+    _run(["./gradlew", "--stop"], cwd=repository_path, check=False, capture_output=True)
 
 
-def build_apk_for_commit(hash, repository_path, build_type):
-    checkout_proc = subprocess.run(["git", "checkout", hash], cwd=repository_path, capture_output=True)
+def build_apk_for_commit(hash, repository_path, build_type, architecture):
+    # Each commit builds in its own detached worktree instead of `git checkout` mutating the
+    # main working tree: commits can build in parallel, and Gradle's incremental caches stop
+    # being invalidated by sources changing underneath them. Returns the apk name in the cwd,
+    # or None if the build failed.
+    worktree_path = os.path.join(tempfile.gettempdir(), "perf-tools-worktree-" + hash)
+    worktree_proc = _run(["git", "worktree", "add", "--detach", worktree_path, hash],
+                         cwd=repository_path, check=False, capture_output=True, text=True)
 
-    if checkout_proc.returncode != 0:
-        print(("\n\nSomething went wrong while checking out this commit: {commit} . The associated error message was:"
-               "\n\n {error}".format(commit=hash, error=checkout_proc.stderr.decode('utf-8').strip("\n"))),
-              file=sys.stderr)
-        return
+    if worktree_proc.returncode != 0:
+        logger.error("Something went wrong while adding a worktree for this commit: %s . The associated error "
+                     "message was:\n%s", hash, worktree_proc.stderr.strip("\n"))
+        return None
+
+    try:
+        # We only want the apk so lint and test are skipped; the daemon is kept warm across commits.
+        assemble_proc = _run(["./gradlew", "--daemon", GRADLE_JVM_ARGS,
+                              "assemble"+build_type, "-x", "lint", "-x", "test"],
+                             cwd=worktree_path, check=False, capture_output=True, text=True)
 
-    assemble_proc = subprocess.run(["./gradlew", "assemble"+build_type], cwd=repository_path, capture_output=True)
+        if assemble_proc.returncode != 0:
+            logger.error("Something went wrong while assembling this build: %s . The associated error message was:"
+                         "\n%s", build_type, assemble_proc.stderr.strip("\n"))
+            return None
 
-    if assemble_proc.returncode != 0:
-        print(("\n\nSomething went wrong while assembling this build: {build} . The associated error message was:"
-               "\n\n {error}".format(build=build_type, error=checkout_proc.stderr.decode('utf-8').strip("\n"))),
-              file=sys.stderr)
+        built_apk_path = build_apk_path_string(worktree_path, build_type, architecture)
+        return move_apk_to_cwd(built_apk_path, hash)
+    finally:
+        _run(["git", "worktree", "remove", "--force", worktree_path],
+             cwd=repository_path, check=False, capture_output=True)
 
 
 def build_apk_path_string(repository_path, build_type, phone_architecture):
@@ -294,48 +628,71 @@ def build_apk_path_string(repository_path, build_type, phone_architecture):
 
 
 def move_apk_to_cwd(apk_path, commit_hash):
+    # Returns the apk name in the cwd, or None if the move failed. shutil.move rather than
+    # os.replace because the worktree lives under the temp dir, which is often a different
+    # filesystem than the cwd and a cross-device rename raises EXDEV.
     new_apk_name = "apk_commit_" + commit_hash + ".apk"
-    proc = subprocess.run(["mv", apk_path, new_apk_name])
-    if proc.returncode != 0:
-        print(("\n\nSomething went wrong while moving the built apk: {apk} . The associated error message was:"
-               "\n\n {error}".format(apk=apk_path, error=proc.stderr.decode('utf-8').strip("\n"))),
-              file=sys.stderr)
+    try:
+        shutil.move(apk_path, new_apk_name)
+    except OSError as err:
+        logger.error("Something went wrong while moving the built apk: %s . The associated error message was:\n%s",
+                     apk_path, err)
+        return None
     return new_apk_name
 
 
 def build_apks_for_commits(
         start_commit=None, end_commit=None, repository_path=None,
         build_type=None, architecture=None, remote_name=""):
-    apk_metadata_array = []
-
     fetch_repository(repository_path, remote_name)
-    array_of_commit_hash = get_all_commits_in_commits_range(start_commit, end_commit, repository_path)
-    clean_project(repository_path)
+    # Materialized because the loop below wants a total count for its progress output and
+    # the daemon warm-up decision; the generator itself still streams git's stdout.
+    array_of_commit_hash = list(get_all_commits_in_commits_range(start_commit, end_commit, repository_path))
+    if not array_of_commit_hash:
+        logger.error("No commits to build in the given range.")
+        return []
 
     numer_of_commits = len(array_of_commit_hash)
-    for index, commit in enumerate(array_of_commit_hash):
+
+    def build_one(index, commit):
         print(f'##### Trying to build {index+1} of {numer_of_commits} Actual commit {commit} #####')
         new_apk_name = "apk_commit_" + commit + ".apk"
-        apk_for_commit_already_exists = Path(new_apk_name).exists()
 
-        if not apk_for_commit_already_exists:
-            build_apk_for_commit(commit, repository_path, build_type)
-            built_apk_name = build_apk_path_string(repository_path, build_type, architecture)
-            new_apk_name = move_apk_to_cwd(built_apk_name, commit)
-        else:
+        if Path(new_apk_name).exists():
             print(f'     SKIPED build for commit {commit}, apk already exists')
+        else:
+            new_apk_name = build_apk_for_commit(commit, repository_path, build_type, architecture)
+            if new_apk_name is None:
+                return None
+
+        # The commits build source only supports fenix (see validate_args).
+        return ApkMetadata(
+            name=new_apk_name,
+            date="",
+            commit=commit,
+            architecture=architecture,
+            product=PROD_FENIX)
 
-        apk_metadata_array.append({
-            KEY_NAME: new_apk_name,
-            KEY_DATETIME: "",
-            KEY_COMMIT: commit,
-            KEY_ARCHITECTURE: architecture})
-    return apk_metadata_array
+    try:
+        if numer_of_commits == 1:
+            apk_metadata_array = [build_one(0, array_of_commit_hash[0])]
+        else:
+            # A lone build starts the daemon itself; pre-warming only pays off across several.
+            warm_gradle_daemon(repository_path)
+            # Worktrees give every build a stable source dir, so commits can build in parallel.
+            with ThreadPoolExecutor(max_workers=min(BUILD_MAX_WORKERS, numer_of_commits)) as executor:
+                apk_metadata_array = list(executor.map(build_one, range(numer_of_commits), array_of_commit_hash))
+    finally:
+        stop_gradle_daemon(repository_path)
+    return [e for e in apk_metadata_array if e is not None]
 
 
 def cleanup(array_of_apk_path):
     for i in array_of_apk_path:
-        subprocess.run(["rm", i[KEY_NAME]])
+        try:
+            os.unlink(i.name)
+        except FileNotFoundError:
+            pass
 
 
 def validate_args(args):
@@ -351,13 +708,47 @@ def validate_args(args):
 
 
 def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
     args = parse_args()
     validate_args(args)
+    start_adb_server()
+
+    config = RunConfig(
+        package_id=PROD_TO_CHANNEL_TO_PKGID[args.product][args.release_channel],
+        measure_script_path=MEASURE_START_UP_SCRIPT,
+        build_type=args.release_channel,
+        tests=args.tests,
+        product=args.product)
 
     if args.build_source == BUILD_SRC_TASKCLUSTER:
         array_of_dates = get_date_array_for_range(args.startdate, args.enddate)
-        array_of_apk_metadata = download_nightly_for_range(array_of_dates, args.architecture, args.product)
+        # Downloads are network-bound and the analysis is device-bound, so they can fully
+        # overlap: a producer thread downloads apks and feeds the bounded queue the analysis
+        # consumes from. Wall clock becomes max(download, analysis) instead of their sum.
+        apk_queue = queue.Queue(maxsize=ANALYSIS_QUEUE_MAX_SIZE)
+        array_of_apk_metadata = []  # Filled by the producer; remembered for cleanup.
+        producer_error = []  # An exception raised on the producer thread, re-raised after join.
+
+        def produce_apks():
+            try:
+                for index, apk_metadata in enumerate(iter_nightly_apks(array_of_dates, args.architecture,
+                                                                       args.product, args.force, args.downloader)):
+                    array_of_apk_metadata.append(apk_metadata)
+                    apk_queue.put((index, apk_metadata))
+            except Exception as err:
+                # A thread would otherwise swallow this: remember it so main can re-raise and
+                # the run fails loudly instead of reporting a silently truncated analysis.
+                producer_error.append(err)
+            finally:
+                if not array_of_apk_metadata:
+                    logger.error("No builds to analyze.")
+                apk_queue.put(_END_OF_QUEUE)
+
+        producer = threading.Thread(target=produce_apks, name="apk-downloads", daemon=True)
+        producer.start()
     elif args.build_source == BUILD_SRC_COMMITS:
+        producer = None
         array_of_apk_metadata = build_apks_for_commits(
             start_commit=args.startcommit,
             end_commit=args.endcommit,
@@ -366,13 +757,17 @@ def main():
             architecture=args.architecture,
             remote_name=args.git_remote_name if args.git_remote_name else "")
 
-    run_performance_analysis_on_nightly(
-        PROD_TO_CHANNEL_TO_PKGID[args.product][args.release_channel],
-        MEASURE_START_UP_SCRIPT,
-        array_of_apk_metadata,
-        args.release_channel,
-        args.tests,
-        args.product)
+        if not array_of_apk_metadata:
+            logger.error("No builds to analyze.")
+            return
+        apk_queue = make_apk_queue(array_of_apk_metadata)
+
+    run_performance_analysis_on_nightly(config, apk_queue, args.jobs)
+
+    if producer is not None:
+        producer.join()
+        if producer_error:
+            raise producer_error[0]
 
     if args.cleanup is True:
         cleanup(array_of_apk_metadata)